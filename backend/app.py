@@ -1,38 +1,53 @@
 # backend/app.py
 from flask import Flask, request, jsonify, send_file, Response
+from flask.json.provider import JSONProvider
 import re
 from docx import Document
 from io import BytesIO
+import zipfile
+from xml.sax.saxutils import escape as xml_escape
 import uuid
 from flask_cors import CORS
 from flask import request
 from dotenv import load_dotenv
-import os, uuid, time, urllib.parse, traceback
+import os, sys, uuid, time, urllib.parse, traceback, hashlib
 from bson.objectid import ObjectId
-from flask import stream_with_context
-import json
+import orjson
+from datetime import datetime, timezone
+import numpy as np
 import time
-DOCX_TEMP = {}
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from functools import lru_cache
+import threading
+from cachetools import TTLCache
+
+# `python app.py` runs this file as __main__; register it as "app" too so
+# `from app import ...` (legal_engine) reuses this module instead of executing
+# it a second time with its own MongoClient, Groq client and Flask app
+if __name__ == "__main__":
+    sys.modules.setdefault("app", sys.modules[__name__])
+
 # AI SDK import (Groq)
 try:
     from groq import Groq
+    import httpx
 except Exception:
     Groq = None
 
 # file utils and extractors
-from pdf_utils import text_to_pdf
+from pdf_utils import text_to_pdf, PDF_DIR
 import fitz  # pymupdf
 import docx
-from pymongo import MongoClient
+from pymongo import MongoClient, WriteConcern
 
 from bson.errors import InvalidId
 
+_OID_RE = re.compile(r"[0-9a-fA-F]{24}")
+
 def is_valid_objectid(value: str):
-    try:
-        ObjectId(value)
-        return True
-    except Exception:
-        return False
+    return isinstance(value, str) and _OID_RE.fullmatch(value) is not None
 
 # Load environment
 load_dotenv()
@@ -40,16 +55,47 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
 MONGODB_URI = os.getenv("MONGODB_URI", "")
 FRONTEND_ORIGIN = os.getenv("FRONTEND_ORIGIN", "*")
 
+# Mongo pool tuning (override per deployment)
+MONGO_MAX_POOL = int(os.getenv("MONGO_MAX_POOL", "200"))
+MONGO_MIN_POOL = int(os.getenv("MONGO_MIN_POOL", "10"))
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")
+# how long an upload's summary is reused for identical file bytes (seconds)
+UPLOAD_CACHE_TTL = int(os.getenv("UPLOAD_CACHE_TTL", "86400"))
+# reportlab holds the GIL, so PDFs render in worker processes
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 2)))
+# fire-and-forget chat message inserts; set to 0 for strict durability
+MONGO_UNACK_MESSAGES = os.getenv("MONGO_UNACK_MESSAGES", "1") == "1"
+
+class ORJSONProvider(JSONProvider):
+    """Back jsonify() and request.get_json() with orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # App init
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app, origins=[FRONTEND_ORIGIN])
 
 # Validate Groq
+client = None
 if Groq is None:
     print("Warning: groq SDK not installed or import failed. Install and configure the groq package.")
 else:
     try:
-        client = Groq(api_key=GROQ_API_KEY)
+        # one keep-alive pool shared by every request; over HTTP/2 concurrent
+        # completions are multiplexed as streams on the same TLS connection
+        client = Groq(
+            api_key=GROQ_API_KEY,
+            http_client=httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+                timeout=60.0,
+            ),
+        )
     except Exception as e:
         print("Warning: could not initialize Groq client:", e)
         client = None
@@ -60,7 +106,21 @@ db = None
 chats = None
 if MONGODB_URI:
     try:
-        mongo = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
+        # keep warm pooled connections so streaming requests don't pay the handshake;
+        # reads are not retried so a slow primary can't stall a stream twice
+        mongo = MongoClient(
+            MONGODB_URI,
+            serverSelectionTimeoutMS=5000,
+            socketTimeoutMS=30000,
+            maxPoolSize=MONGO_MAX_POOL,
+            minPoolSize=MONGO_MIN_POOL,
+            maxIdleTimeMS=300_000,
+            # fail fast instead of queueing forever if the pool is exhausted
+            waitQueueTimeoutMS=10_000,
+            compressors=MONGO_COMPRESSORS,
+            retryWrites=True,
+            retryReads=False,
+        )
         mongo.admin.command("ping")
         db = mongo.get_database("legalsathi")
         chats = db.get_collection("chats")
@@ -74,10 +134,64 @@ else:
 if db is not None and chats is None:
     chats = db.get_collection("chats")
 
+# collection handles, bound once instead of per request
+conversations_col = messages_col = file_records_col = upload_cache_col = None
+# fire-and-forget handle for chat messages (w=0 skips waiting for the ack);
+# conversation updates stay acknowledged because recent_messages is the
+# context the next turn reads
+messages_write = None
+if db is not None:
+    conversations_col = db.get_collection("conversations")
+    messages_col = db.get_collection("messages")
+    file_records_col = db.get_collection("file_records")
+    upload_cache_col = db.get_collection("upload_cache")
+    messages_write = db.get_collection(
+        "messages",
+        write_concern=WriteConcern(w=0) if MONGO_UNACK_MESSAGES else None
+    )
+
+    # compound indexes so the hot match+sort queries are index scans
+    try:
+        messages_col.create_index([("conv_id", 1), ("timestamp", -1)])
+        conversations_col.create_index([("user_id", 1), ("updated_at", -1)])
+        file_records_col.create_index([("user_id", 1), ("timestamp", -1)])
+        # Mongo's TTL monitor drops stale upload summaries (Redis SETEX-style)
+        upload_cache_col.create_index("cached_at", expireAfterSeconds=UPLOAD_CACHE_TTL)
+    except Exception as e:
+        print("MongoDB index warning:", e)
+
+
+# background pool for Mongo work that should not hold up a response
+_PERSIST_POOL = ThreadPoolExecutor(max_workers=4)
+
+# DOCX builds are mostly zlib work (releases the GIL), a thread is enough
+_DOCX_POOL = ThreadPoolExecutor(max_workers=4)
+
+# background PDF rendering; /download waits on a pending job if needed.
+# forkserver (rather than fork) keeps children from inheriting this
+# process's Mongo/httpx threads. Each child still re-imports the launching
+# script as __mp_main__: harmless for the gunicorn/flask entry points, but
+# under `python app.py` that would rerun this whole module (Mongo connect,
+# Groq client, pools) per worker, so the dev server renders on threads.
+def _new_pdf_pool():
+    if __name__ == "__main__":
+        return ThreadPoolExecutor(max_workers=4)
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload(["pdf_utils"])
+    return ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=ctx)
+
+_PDF_POOL = _new_pdf_pool()
+_pdf_pool_lock = threading.Lock()
+PDF_JOBS = {}
+DOCX_JOBS = {}
 
 UPLOAD_FOLDER = "uploads"
+UPLOAD_EXTENSIONS = (".pdf", ".docx", ".txt")
+# how much document text an upload feeds to the AI
+DOC_CONTEXT_CHARS = 8000
+# per-message cap when replaying history into the prompt
+MAX_CONTEXT_MESSAGE_CHARS = 4000
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs("generated_pdfs", exist_ok=True)
 
 # Basic GST calculation helper:
 def calculate_gst(amount: float, rate_percent: float, inclusive=False, interstate=False):
@@ -115,30 +229,78 @@ def calculate_gst(amount: float, rate_percent: float, inclusive=False, interstat
         "inclusive": inclusive,
         "interstate": interstate,
     }
+
+GST_BATCH_COLUMNS = ("base_amount", "gst_amount", "cgst", "sgst", "igst", "total_amount")
+
+def calculate_gst_batch(amounts, rate_percent, inclusive=False, interstate=False):
+    """
+    Vectorised calculate_gst for invoice line items.
+    Returns an (N, 6) array ordered as GST_BATCH_COLUMNS, rounded to 2 places.
+    """
+    a = np.asarray(amounts, dtype=np.float64)
+    r = float(rate_percent or 0.0)
+    if inclusive:
+        base = a / (1 + r/100)
+        gst_amount = a - base
+    else:
+        base = a
+        gst_amount = base * r / 100.0
+
+    zero = np.zeros_like(gst_amount)
+    if interstate:
+        cgst = sgst = zero
+        igst = gst_amount
+    else:
+        cgst = sgst = gst_amount / 2.0
+        igst = zero
+
+    out = np.stack([base, gst_amount, cgst, sgst, igst, base + gst_amount], axis=1)
+    # Python's round(), not np.round: np.round scales by 100 first and can land
+    # a cent away from calculate_gst on values like 5705.925
+    return np.array([round(x, 2) for x in out.ravel().tolist()]).reshape(out.shape)
+
 def trim_messages(messages, max_chars=8000):
     """
     Ensure the message history does not exceed max_chars.
-    We trim oldest messages first.
+    We trim oldest messages first, but always keep the leading
+    system prompt and the newest message.
     """
-    total = sum(len(m["content"]) for m in messages)
+    lens = [len(m["content"]) for m in messages]
+    total = sum(lens)
 
     if total <= max_chars:
         return messages
 
-    trimmed = []
-    running = 0
+    head = 1 if messages and messages[0]["role"] == "system" else 0
+    start = head
+    last = len(messages) - 1
 
-    # keep only the most recent messages
-    for m in reversed(messages):
-        length = len(m["content"])
-        if running + length <= max_chars:
-            trimmed.append(m)
-            running += length
-        else:
-            break
+    # single pass: drop from the oldest end until we fit
+    while total > max_chars and start < last:
+        total -= lens[start]
+        start += 1
 
-    # restore chronological order
-    return list(reversed(trimmed))
+    return messages[:head] + messages[start:]
+
+# --- Reply cache ---
+# identical requests (same system prompt, history and message) reuse the
+# previous answer instead of calling Groq again; per worker process
+REPLY_CACHE_TTL = int(os.getenv("REPLY_CACHE_TTL", "3600"))
+_reply_cache = TTLCache(maxsize=10_000, ttl=REPLY_CACHE_TTL)
+_reply_cache_lock = threading.Lock()
+
+def reply_cache_key(messages):
+    return hashlib.sha256(orjson.dumps(messages)).digest()
+
+def get_cached_reply(key):
+    with _reply_cache_lock:
+        return _reply_cache.get(key)
+
+def cache_reply(key, reply):
+    # never pin error / fallback text
+    if reply and not reply.startswith("⚠️") and "[Streaming failed]" not in reply:
+        with _reply_cache_lock:
+            _reply_cache[key] = reply
 
 # --- AI helper ---
 def ask_ai(context, prompt):
@@ -180,28 +342,131 @@ def ask_ai(context, prompt):
             messages = [{"role": "system", "content": "You are LegalSathi."},
                         {"role": "user", "content": "No input"}]
 
+        cache_key = reply_cache_key(messages)
+        cached = get_cached_reply(cache_key)
+        if cached is not None:
+            return cached
+
         completion = client.chat.completions.create(
             model="llama-3.1-8b-instant",
             messages=messages
         )
-        return completion.choices[0].message.content.strip()
+        reply = completion.choices[0].message.content.strip()
+        cache_reply(cache_key, reply)
+        return reply
     except Exception as e:
         print("Groq Error:", e)
         traceback.print_exc()
         return "⚠️ Sorry, the AI faced an error. Please try again."
 
+def _submit_pdf(text, pdfname):
+    """
+    Submit text_to_pdf to the PDF pool. A child that died (OOM kill,
+    segfault) leaves the pool broken for good, so replace it once; if that
+    fails too, render on a thread so the caller still gets a job.
+    """
+    global _PDF_POOL
+    pool = _PDF_POOL
+    try:
+        return pool.submit(text_to_pdf, text, pdfname)
+    except BrokenProcessPool as e:
+        print("PDF pool broken, restarting it:", e)
+    try:
+        with _pdf_pool_lock:
+            # another request may have replaced it already
+            if _PDF_POOL is pool:
+                _PDF_POOL = _new_pdf_pool()
+            pool = _PDF_POOL
+        return pool.submit(text_to_pdf, text, pdfname)
+    except Exception as e:
+        print("PDF pool unavailable, rendering on a thread:", e)
+        return _DOCX_POOL.submit(text_to_pdf, text, pdfname)
+
+# a .part file older than this belongs to a render that died with its worker
+PART_STALE_SECONDS = 120
+
+def _mark_pending(path):
+    """
+    Create <path>.part before the job is queued. PDF_JOBS/DOCX_JOBS only
+    exist in the worker that submitted the job; the placeholder tells every
+    gunicorn worker the file is on its way, even before rendering starts.
+    """
+    open(path + ".part", "wb").close()
+
+def _clear_failed(path, fut):
+    # a failed job never renames its .part; drop it so readers stop waiting
+    if fut.exception() is not None:
+        try:
+            os.remove(path + ".part")
+        except OSError:
+            pass
+
+def render_pending(path):
+    """True while <path>.part exists and is fresh, i.e. a render is queued or running."""
+    try:
+        return time.time() - os.path.getmtime(path + ".part") < PART_STALE_SECONDS
+    except OSError:
+        return False
+
+def render_pdf_async(text, pdfname):
+    """Queue text_to_pdf on the PDF pool and track it until it finishes."""
+    path = os.path.join(PDF_DIR, pdfname)
+    _mark_pending(path)
+    fut = _submit_pdf(text, pdfname)
+    PDF_JOBS[pdfname] = fut
+    fut.add_done_callback(lambda _f: PDF_JOBS.pop(pdfname, None))
+    fut.add_done_callback(lambda f: _clear_failed(path, f))
+    return fut
+
+def render_docx_async(text, docx_name):
+    """Build the DOCX on a thread and write it next to the PDFs."""
+    path = os.path.join(PDF_DIR, docx_name)
+    def job():
+        _, buffer = generate_docx_stream(text, docx_name)
+        # write then rename, so a download never sees a half-written file
+        with open(path + ".part", "wb") as f:
+            f.write(buffer.getbuffer())
+        os.replace(path + ".part", path)
+    _mark_pending(path)
+    fut = _DOCX_POOL.submit(job)
+    DOCX_JOBS[docx_name] = fut
+    fut.add_done_callback(lambda _f: DOCX_JOBS.pop(docx_name, None))
+    fut.add_done_callback(lambda f: _clear_failed(path, f))
+    return fut
+
 # --- File Text Extractors ---
-def extract_pdf_text(filepath):
-    text = ""
+def extract_pdf_text(filepath, max_chars=None):
+    """
+    Join page texts once (no repeated string rebuilding).
+    With max_chars, stop reading pages once that much text is collected.
+    """
+    parts, total = [], 0
     with fitz.open(filepath) as pdf:
         for page in pdf:
-            text += page.get_text("text") + "\n"
-    return text.strip()
+            # plain extraction: no ligature/whitespace preservation passes,
+            # only keep the default clip to the visible page
+            t = page.get_text("text", flags=fitz.TEXT_MEDIABOX_CLIP)
+            parts.append(t)
+            total += len(t) + 1
+            if max_chars and total >= max_chars:
+                break
+    return "\n".join(parts).strip()
 
 
-def extract_docx_text(filepath):
+def extract_docx_text(filepath, max_chars=None):
+    """
+    Same early exit as extract_pdf_text: stop collecting paragraphs
+    once max_chars of text is gathered.
+    """
     doc = docx.Document(filepath)
-    return "\n".join([p.text for p in doc.paragraphs])
+    parts, total = [], 0
+    for p in doc.paragraphs:
+        t = p.text
+        parts.append(t)
+        total += len(t) + 1
+        if max_chars and total >= max_chars:
+            break
+    return "\n".join(parts)
 
 # --- Conversation helpers ---
 def create_conversation(user_id, title="New conversation"):
@@ -209,45 +474,221 @@ def create_conversation(user_id, title="New conversation"):
         "user_id": user_id,
         "title": title,
         "created_at": time.time(),
-        "updated_at": time.time()
+        "updated_at": time.time(),
+        "recent_messages": []
     }
-    res = db.get_collection("conversations").insert_one(conv)
+    res = conversations_col.insert_one(conv)
     conv["_id"] = str(res.inserted_id)
     return conv
 
-def add_message(conv_id, role, content):
-    msg = {
-        "conv_id": ObjectId(conv_id),
-        "role": role,
-        "content": content,
-        "timestamp": time.time()
-    }
-    db.get_collection("messages").insert_one(msg)
+# ownership lookups are cached per worker; the short TTL bounds how long
+# another worker keeps trusting a conversation deleted elsewhere
+OWNER_CACHE_TTL = int(os.getenv("OWNER_CACHE_TTL", "30"))
+_owner_cache = TTLCache(maxsize=4096, ttl=OWNER_CACHE_TTL)
+_owner_cache_lock = threading.Lock()
+
+def conversation_owner(conv_id):
+    """
+    user_id owning a conversation (None if it doesn't exist).
+    Misses are not cached, so a conversation created on another worker is
+    seen on its first turn here.
+    """
+    with _owner_cache_lock:
+        owner = _owner_cache.get(conv_id)
+    if owner is not None:
+        return owner
+    doc = conversations_col.find_one({"_id": ObjectId(conv_id)}, {"user_id": 1})
+    if not doc:
+        return None
+    with _owner_cache_lock:
+        _owner_cache[conv_id] = doc["user_id"]
+    return doc["user_id"]
+
+def add_message(conv_id, role, content, timestamp=None):
+    add_messages(conv_id, [(role, content, timestamp)])
+
+def add_messages(conv_id, items):
+    """
+    Insert several (role, content, timestamp[, extra_fields]) messages in
+    one round trip. A timestamp of None means "now".
+    """
+    oid = ObjectId(conv_id)
+    now = time.time()
+    docs = []
+    for role, content, ts, *extra in items:
+        doc = {"conv_id": oid, "role": role, "content": content, "timestamp": ts or now}
+        if extra:
+            doc.update(extra[0])
+        docs.append(doc)
+    messages_write.insert_many(docs)
+
+# the sidebar only shows (and searches) the start of the latest reply
+LAST_MESSAGE_CHARS = 200
+
+def message_snippet(text):
+    return text if len(text) <= LAST_MESSAGE_CHARS else text[:LAST_MESSAGE_CHARS] + "..."
+
+# conversations keep a capped copy of their latest messages so the chat
+# hot path reads context with one find_one instead of querying messages
+RECENT_MESSAGES = 12
+
+def push_recent(*pairs):
+    """$push clause appending (role, content) pairs to recent_messages, keeping the last RECENT_MESSAGES."""
+    return {"recent_messages": {
+        "$each": [{"role": role, "content": content[:MAX_CONTEXT_MESSAGE_CHARS]}
+                  for role, content in pairs],
+        "$slice": -RECENT_MESSAGES,
+    }}
+
+def _persist_turn(conv_id, user_message, user_ts, final_text, truncated=False):
+    """
+    Save the user message + assistant reply together and refresh conversation
+    metadata. Runs on _PERSIST_POOL so the stream can finish without waiting on Mongo.
+    truncated=True marks a reply cut short because the client disconnected.
+    """
+    try:
+        add_messages(conv_id, [
+            ("user", user_message, user_ts),
+            ("assistant", final_text, None, {"truncated": True} if truncated else {}),
+        ])
+        conversations_col.update_one(
+            {"_id": ObjectId(conv_id)},
+            {
+                "$set": {
+                    "updated_at": time.time(),
+                    "title": (final_text[:60] or "Conversation"),
+                    "last_message": message_snippet(final_text)
+                },
+                "$push": push_recent(("user", user_message), ("assistant", final_text))
+            }
+        )
+    except Exception as e:
+        print("Save assistant error:", e)
+
+def _save_upload_start(conv, messages):
+    """Create the upload's conversation (when new) and insert its first messages."""
+    if conv is not None:
+        conversations_col.insert_one(conv)
+    messages_col.insert_many(messages)
+
+def _save_file_record(record):
+    try:
+        file_records_col.insert_one(record)
+    except Exception as e:
+        print("file record save error:", e)
+
+# --- Upload cache (keyed by SHA-256 of the uploaded bytes) ---
+def get_cached_upload(content_sha256):
+    if upload_cache_col is None:
+        return None
+    try:
+        return upload_cache_col.find_one({"_id": content_sha256})
+    except Exception as e:
+        print("upload cache lookup error:", e)
+        return None
+
+def cache_upload(content_sha256, extracted_text, reply, pdfname):
+    if upload_cache_col is None:
+        return
+    try:
+        upload_cache_col.update_one(
+            {"_id": content_sha256},
+            {"$set": {
+                "extracted_text": extracted_text,
+                "reply": reply,
+                "pdf": pdfname,
+                "timestamp": time.time(),
+                # TTL indexes need a BSON date
+                "cached_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+    except Exception as e:
+        print("upload cache store error:", e)
+
+def _recent_from_messages(oid, limit):
+    """Last `limit` messages of a conversation, oldest first, from the messages collection."""
+    msgs = list(messages_col.aggregate([
+        {"$match": {"conv_id": oid}},
+        {"$sort": {"timestamp": -1}},
+        {"$limit": limit},
+        # $substrCP counts code points, so multi-byte text is never split mid-character
+        {"$project": {"_id": 0, "role": 1,
+                      "content": {"$substrCP": ["$content", 0, MAX_CONTEXT_MESSAGE_CHARS]}}},
+    ]))
+    # restore chronological order
+    msgs.reverse()
+    return msgs
+
+def backfill_recent(oid):
+    """
+    Seed recent_messages for a conversation saved before the field existed.
+    Must run before the conversation's next $push, which would otherwise
+    create the array holding only the new messages.
+    """
+    msgs = _recent_from_messages(oid, RECENT_MESSAGES)
+    conversations_col.update_one(
+        {"_id": oid, "recent_messages": {"$exists": False}},
+        {"$set": {"recent_messages": msgs}})
+    return msgs
+
+def ensure_recent(oid):
+    """backfill_recent, only if the conversation doesn't have recent_messages yet."""
+    if conversations_col.find_one({"_id": oid, "recent_messages": {"$exists": False}}, {"_id": 1}):
+        backfill_recent(oid)
 
 def build_context(conv_id, max_messages=12):
     """
     Returns list of dicts for system/user messages suitable to include with AI call.
     We'll include last N messages from the conversation.
+    Each message is capped at MAX_CONTEXT_MESSAGE_CHARS, so one huge pasted
+    document can't eat the whole prompt budget (or the egress).
+    Reads the conversation's recent_messages array; conversations saved
+    before it existed get it backfilled from the messages collection.
+    """
+    oid = ObjectId(conv_id)
+    if max_messages <= RECENT_MESSAGES:
+        doc = conversations_col.find_one(
+            {"_id": oid},
+            {"_id": 0, "recent_messages": {"$slice": -max_messages}})
+        if doc is not None:
+            if "recent_messages" not in doc:
+                return backfill_recent(oid)[-max_messages:]
+            return doc["recent_messages"]
+
+    return _recent_from_messages(oid, max_messages)
+
+# stop nginx / edge proxies from buffering the stream until EOF
+# (Connection is hop-by-hop and not allowed from a WSGI app)
+SSE_HEADERS = {"X-Accel-Buffering": "no", "Cache-Control": "no-cache"}
+
+def sse_event(payload):
+    """Encode one server-sent event frame carrying a JSON payload (as bytes)."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+# token coalescing: flush buffered deltas at this size or age
+STREAM_FLUSH_CHARS = 64
+STREAM_FLUSH_SECONDS = 0.02
+
+def sse_chunk(text):
     """
-    msgs = list(db.get_collection("messages")
-                .find({"conv_id": ObjectId(conv_id)})
-                .sort("timestamp", -1)
-                .limit(max_messages))
-    msgs = list(reversed(msgs))
-    # convert to simple list:
-    return [{"role": m["role"], "content": m["content"]} for m in msgs]
-
-def simulate_stream(text, chunk_size=30, delay=0.03):
+    Per-token frame, byte-identical to sse_event({"chunk": text}) but without
+    building a dict for every delta. Text stays JSON-encoded so newlines in
+    a delta can't break SSE framing.
     """
-    Yield the text in small chunks (fallback if AI SDK has no streaming).
-    chunk_size is characters per chunk.
+    return b'data: {"chunk":' + orjson.dumps(text) + b'}\n\n'
+
+def orjson_response(obj):
+    """jsonify() replacement for hot list endpoints."""
+    return Response(orjson.dumps(obj), mimetype="application/json")
+
+def simulate_stream(text, chunk_size=512):
     """
-    i = 0
-    while i < len(text):
-        chunk = text[i:i+chunk_size]
-        i += chunk_size
-        time.sleep(delay)  # short pause so frontend gets streaming feel
-        yield chunk
+    Yield an already-complete text (fallback if AI SDK streaming fails).
+    chunk_size only caps frame size; there is no artificial delay.
+    """
+    for i in range(0, len(text), chunk_size):
+        yield text[i:i+chunk_size]
 
 # ============================================================
 #  GLOBAL LEGAL INTENT ROUTER + JURISDICTION DETECTOR + STYLE ENGINE
@@ -259,40 +700,38 @@ def simulate_stream(text, chunk_size=30, delay=0.03):
 # -------------------------------------------
 # 1. AUTO JURISDICTION DETECTOR (GLOBAL)
 # -------------------------------------------
+# keyword tables are built once; order is priority (first hit wins).
+# A tuple, not a set: set iteration order changes between processes, which
+# made the chosen state arbitrary when a message named two of them.
+_USA_STATES = (
+    "california", "texas", "new york", "florida", "illinois",
+    "ohio", "georgia", "pennsylvania", "washington", "virginia",
+)
+
+_COUNTRY_RULES = (
+    (("india", "gst", "gstr"), ("India", "India")),
+    (("dubai", "uae", "sharjah", "fta"), ("UAE", "UAE")),
+    (("singapore",), ("Singapore", "Singapore")),
+    (("uk", "england", "wales", "hmrc"), ("UK", "United Kingdom")),
+    (("australia", "nsw", "queensland"), ("Australia", "Australia")),
+    (("canada",), ("Canada", "Canada")),
+    (("europe", "eu", "gdpr"), ("EU", "European Union")),
+)
+
 def detect_jurisdiction(text: str):
-    t = text.lower()
+    return _detect_jurisdiction(text.lower())
 
+def _detect_jurisdiction(t):
     # USA STATES
-    usa_states = {
-        "california", "texas", "new york", "florida", "illinois",
-        "ohio", "georgia", "pennsylvania", "washington", "virginia"
-    }
-
-    for st in usa_states:
+    for st in _USA_STATES:
         if st in t:
             return ("USA", st.title())
 
     # COUNTRY DETECTION
-    if "india" in t or "gst" in t or "gstr" in t:
-        return ("India", "India")
-
-    if "dubai" in t or "uae" in t or "sharjah" in t or "fta" in t:
-        return ("UAE", "UAE")
-
-    if "singapore" in t:
-        return ("Singapore", "Singapore")
-
-    if "uk" in t or "england" in t or "wales" in t or "hmrc" in t:
-        return ("UK", "United Kingdom")
-
-    if "australia" in t or "nsw" in t or "queensland" in t:
-        return ("Australia", "Australia")
-
-    if "canada" in t:
-        return ("Canada", "Canada")
-
-    if "europe" in t or "eu" in t or "gdpr" in t:
-        return ("EU", "European Union")
+    for keywords, result in _COUNTRY_RULES:
+        for kw in keywords:
+            if kw in t:
+                return result
 
     # Default global
     return ("Global", "Generic")
@@ -301,41 +740,62 @@ def detect_jurisdiction(text: str):
 # -------------------------------------------
 # 2. WRITING STYLE DETECTOR (Simple vs Legal English)
 # -------------------------------------------
+# "section" also covers "sub-section"
+_LEGAL_STYLE_TERMS = (
+    "whereas", "hereto", "hereby", "indemnity",
+    "governing law", "jurisdiction", "arbitration",
+    "non-disclosure", "breach", "termination clause",
+    "section", "pursuant", "notwithstanding",
+    "liability", "force majeure",
+)
+
 def detect_writing_style(message: str):
     """
     Auto-detect style:
     - Simple English for common users
     - Legal English for professional/legal queries
     """
+    return _detect_writing_style(message.lower())
 
-    msg = message.lower()
-
-    legal_keywords = [
-        "whereas", "hereto", "hereby", "indemnity",
-        "governing law", "jurisdiction", "arbitration",
-        "non-disclosure", "breach", "termination clause",
-        "section", "sub-section", "pursuant", "notwithstanding",
-        "liability", "force majeure"
-    ]
-
-    if any(word in msg for word in legal_keywords):
+def _detect_writing_style(msg):
+    if any(word in msg for word in _LEGAL_STYLE_TERMS):
         return "legal"
 
-    if len(message.split()) < 6:
-        return "simple"
-
-    # Tax & notice replies use simple format by default
-    tax_flags = ["gst", "vat", "irs", "hmrc", "fta", "143", "notice", "scn", "drc"]
-    if any(w in msg for w in tax_flags):
-        return "simple"
-
-    # Default
+    # Everything else -- short questions, tax & notice replies, general
+    # chat -- uses the simple format, so no further scanning is needed.
     return "simple"
 
 
 # -------------------------------------------
 # 3. GLOBAL LEGAL INTENT ROUTER
 # -------------------------------------------
+# Keyword tables are built once at import. Plain `in` checks stay: CPython's
+# substring search beats a combined re alternation on these short literals.
+_CONTRACT_TERMS = (
+    "draft agreement", "draft contract", "prepare agreement", "create contract",
+    "employment agreement", "rental agreement", "partnership deed",
+    "mou", "nda", "service agreement", "lease agreement",
+)
+
+# tax notices: literal ids/phrases use `in`; only the two tokens that need
+# word boundaries ("scn", "148") go through one precompiled regex
+_TAX_TERMS = (
+    "drc-01", "asmt-10", "143(1)", "143(2)",
+    "gst notice", "vat notice", "hmrc", "irs", "cp2000", "fta notice",
+)
+_TAX_WORD_RE = re.compile(r"\b(?:scn|148)\b")
+
+_KEYWORD_INTENTS = (
+    # GENERAL NOTICE / LEGAL REPLY
+    ("notice_reply", ("legal notice", "reply notice", "send a notice")),
+    # CLAUSE REVIEW
+    ("clause_review", ("review clause", "improve clause", "rewrite clause", "redraft clause")),
+    # DOCUMENT SUMMARY
+    ("document_summary", ("summarize", "highlight points", "explain this document")),
+    # LAWYER MODE
+    ("lawyer_mode", ("section", "supreme court", "precedent")),
+)
+
 def detect_legal_intent(message: str):
     """
     Returns one of:
@@ -347,104 +807,95 @@ def detect_legal_intent(message: str):
     - 'lawyer_mode'
     - 'generic_chat'
     """
+    return _detect_legal_intent(message.lower())
 
-    m = message.lower()
+def _detect_legal_intent(m):
 
     # CONTRACT / AGREEMENT DRAFTING
-    contract_terms = [
-        "draft agreement", "draft contract", "prepare agreement", "create contract",
-        "employment agreement", "rental agreement", "partnership deed",
-        "mou", "nda", "service agreement", "lease agreement"
-    ]
-    if any(t in m for t in contract_terms):
+    if any(t in m for t in _CONTRACT_TERMS):
         return "contract"
 
     # TAX REPLY
-    tax_patterns = [
-        r"\bscn\b", r"drc-01", r"asmt-10", r"143\(1\)", r"143\(2\)", r"\b148\b",
-        "gst notice", "vat notice", "hmrc", "irs", "cp2000", "fta notice"
-    ]
-    if any(re.search(p, m) for p in tax_patterns):
+    if any(t in m for t in _TAX_TERMS) or _TAX_WORD_RE.search(m):
         return "tax_reply"
 
-    # GENERAL NOTICE / LEGAL REPLY
-    if "legal notice" in m or "reply notice" in m or "send a notice" in m:
-        return "notice_reply"
+    # remaining plain-keyword intents, in priority order
+    for intent, terms in _KEYWORD_INTENTS:
+        if any(t in m for t in terms):
+            return intent
 
-    # CLAUSE REVIEW
-    review_terms = ["review clause", "improve clause", "rewrite clause", "redraft clause"]
-    if any(t in m for t in review_terms):
-        return "clause_review"
+    # Default
+    return "generic_chat"
 
-    # DOCUMENT SUMMARY
-    if "summarize" in m or "highlight points" in m or "explain this document" in m:
-        return "document_summary"
+# short prompts ("summarize", "draft NDA") repeat a lot; longer pastes are
+# rarely identical and would only bloat the cache
+ROUTE_CACHE_MAX_CHARS = 512
 
-    # LAWYER MODE
-    if "section" in m or "supreme court" in m or "precedent" in m:
-        return "lawyer_mode"
+@lru_cache(maxsize=4096)
+def _route_cached(t):
+    return _detect_legal_intent(t), _detect_jurisdiction(t), _detect_writing_style(t)
 
-    # Default
-    return "generic_chat"
+def route_message(message: str):
+    """
+    (intent, jurisdiction, style) for a chat message.
+    Lower-cases once and shares it across the three detectors.
+    """
+    t = message.lower()
+    if len(t) <= ROUTE_CACHE_MAX_CHARS:
+        return _route_cached(t)
+    return _detect_legal_intent(t), _detect_jurisdiction(t), _detect_writing_style(t)
 
 # conversation_builder.py
 
 
-def build_conversation(conv_id, new_user_message):
+def build_conversation(conv_id, new_user_message, max_messages=30):
     """
     Builds a ChatGPT-style conversation history.
     System messages (document contents) are included.
+    Only the newest max_messages are read, and only role/content, so long
+    threads don't pull every stored file blob out of Mongo.
     """
-    messages_col = db.get_collection("messages")
-
-    # fetch all messages in this conversation
-    msgs = list(messages_col.find({"conv_id": ObjectId(conv_id)}).sort("timestamp", 1))
-
-    formatted = []
-
-    for m in msgs:
-        role = m["role"]  # system, user, assistant
-        content = m["content"]
-
-        # pass as-is
-        formatted.append({"role": role, "content": content})
+    # projected docs are already {"role", "content"}: no per-message copy
+    formatted = list(messages_col
+                     .find({"conv_id": ObjectId(conv_id)},
+                           projection={"role": 1, "content": 1, "_id": 0})
+                     .sort("timestamp", -1)
+                     .limit(max_messages))
+    formatted.reverse()
 
     # finally append the NEW user message
     formatted.append({"role": "user", "content": new_user_message})
 
     return formatted
 
-def generate_contract(jurisdiction, message, style="simple"):
-    """
-    Generate a global contract draft template based on jurisdiction.
-    """
-    country, region = jurisdiction
-
-    # Writing style
-    if style == "legal":
-        tone = "Use formal legal English, contract-style sentences, numbered clauses, and professional structure."
-    else:
-        tone = "Use clear, simple English with easy-to-understand clauses."
-
-    # Jurisdiction-specific governing law
-    governing = {
-        "India": "This Agreement shall be governed by the laws of India.",
-        "UAE": "This Agreement shall be governed by the laws of the United Arab Emirates.",
-        "USA": f"This Agreement shall be governed by the laws of the State of {region}, USA.",
-        "UK": "This Agreement shall be governed by the laws of England and Wales.",
-        "Singapore": "This Agreement shall be governed by the laws of Singapore.",
-        "Australia": "This Agreement shall be governed by the laws of Australia.",
-        "Canada": "This Agreement shall be governed by the laws of Canada.",
-        "EU": "This Agreement shall comply with relevant EU Contract Laws and Regulations.",
-        "Global": "This Agreement shall be interpreted under internationally accepted legal principles."
-    }.get(country, "This Agreement shall be interpreted under internationally accepted legal principles.")
-
-    draft = f"""
-{tone}
+# Static pieces of the contract draft, split around the per-request fields
+# so each call only joins a handful of strings.
+_CONTRACT_TONES = {
+    "legal": "Use formal legal English, contract-style sentences, numbered clauses, and professional structure.",
+    "simple": "Use clear, simple English with easy-to-understand clauses.",
+}
+
+# Jurisdiction-specific governing law ("{region}" is filled in for USA)
+_GOVERNING_LAW = {
+    "India": "This Agreement shall be governed by the laws of India.",
+    "UAE": "This Agreement shall be governed by the laws of the United Arab Emirates.",
+    "USA": "This Agreement shall be governed by the laws of the State of {region}, USA.",
+    "UK": "This Agreement shall be governed by the laws of England and Wales.",
+    "Singapore": "This Agreement shall be governed by the laws of Singapore.",
+    "Australia": "This Agreement shall be governed by the laws of Australia.",
+    "Canada": "This Agreement shall be governed by the laws of Canada.",
+    "EU": "This Agreement shall comply with relevant EU Contract Laws and Regulations.",
+    "Global": "This Agreement shall be interpreted under internationally accepted legal principles."
+}
+_GOVERNING_DEFAULT = _GOVERNING_LAW["Global"]
+
+_CONTRACT_HEAD = """
 
 ### AGREEMENT / CONTRACT – AUTO-DRAFTED
 
-**Jurisdiction:** {country} ({region})
+**Jurisdiction:** """
+
+_CONTRACT_PURPOSE = """
 
 ---
 
@@ -457,7 +908,9 @@ This Agreement is made between:
 
 ### 2. Purpose
 Describe the purpose of this contract clearly:
-“{message[:300]}...”
+“"""
+
+_CONTRACT_BODY = """...”
 
 ---
 
@@ -527,7 +980,9 @@ Disputes shall be resolved through:
 ---
 
 ### 13. Governing Law
-{governing}
+"""
+
+_CONTRACT_TAIL = """
 
 ---
 
@@ -539,39 +994,47 @@ Party B: _____________________  Date: ________
 
 ---
 
-*This is an auto-generated draft. Please review before use.*
-"""
-
-    return draft.strip()
-
+*This is an auto-generated draft. Please review before use.*"""
 
-# -------------------------------------------
-# 5. TAX NOTICE REPLY ENGINE (GLOBAL)
-# -------------------------------------------
-def generate_tax_reply(jurisdiction, message, style="simple"):
+def generate_contract(jurisdiction, message, style="simple"):
     """
-    Automatically generate a tax notice reply for GST/VAT/IRS/HMRC/Income Tax.
+    Generate a global contract draft template based on jurisdiction.
     """
     country, region = jurisdiction
 
-    intro = {
-        "India": "Subject: Reply to GST / Income Tax Notice",
-        "UAE": "Subject: Response to UAE FTA VAT Notice",
-        "UK": "Subject: Response to HMRC VAT Compliance Notice",
-        "USA": "Subject: Response to IRS Notice (including CP2000)",
-        "EU": "Subject: Response to EU Tax Compliance Communication",
-        "Global": "Subject: Response to Tax / Compliance Notice"
-    }.get(country, "Subject: Reply to Tax Notice")
-
-    if style == "legal":
-        tone = "Use formal language suitable for tax authorities, referencing relevant statutes where appropriate."
-    else:
-        tone = "Explain clearly in simple English without legal jargon."
+    # Writing style
+    tone = _CONTRACT_TONES["legal" if style == "legal" else "simple"]
+
+    governing = _GOVERNING_LAW.get(country, _GOVERNING_DEFAULT)
+    if country == "USA":
+        governing = governing.format(region=region)
 
-    reply = f"""
-{intro}
+    return "".join((
+        tone, _CONTRACT_HEAD, country, " (", region, ")",
+        _CONTRACT_PURPOSE, message[:300], _CONTRACT_BODY, governing, _CONTRACT_TAIL,
+    ))
 
-{tone}
+
+# -------------------------------------------
+# 5. TAX NOTICE REPLY ENGINE (GLOBAL)
+# -------------------------------------------
+_TAX_INTROS = {
+    "India": "Subject: Reply to GST / Income Tax Notice",
+    "UAE": "Subject: Response to UAE FTA VAT Notice",
+    "UK": "Subject: Response to HMRC VAT Compliance Notice",
+    "USA": "Subject: Response to IRS Notice (including CP2000)",
+    "EU": "Subject: Response to EU Tax Compliance Communication",
+    "Global": "Subject: Response to Tax / Compliance Notice"
+}
+_TAX_INTRO_DEFAULT = "Subject: Reply to Tax Notice"
+
+_TAX_TONES = {
+    "legal": "Use formal language suitable for tax authorities, referencing relevant statutes where appropriate.",
+    "simple": "Explain clearly in simple English without legal jargon.",
+}
+
+# static reply skeleton, split around the quoted notice text
+_TAX_HEAD = """
 
 ---
 
@@ -585,7 +1048,9 @@ def generate_tax_reply(jurisdiction, message, style="simple"):
 ### 2. Acknowledgement
 We acknowledge receipt of your notice regarding:
 
-“{message[:250]}...”
+“"""
+
+_TAX_TAIL = """...”
 
 ---
 
@@ -640,29 +1105,87 @@ Date: _____________________
 
 ---
 
-*This is an auto-generated reply. Cross-check before submission.*
-"""
+*This is an auto-generated reply. Cross-check before submission.*"""
+
+def generate_tax_reply(jurisdiction, message, style="simple"):
+    """
+    Automatically generate a tax notice reply for GST/VAT/IRS/HMRC/Income Tax.
+    """
+    country, region = jurisdiction
 
-    return reply.strip()
+    intro = _TAX_INTROS.get(country, _TAX_INTRO_DEFAULT)
+    tone = _TAX_TONES["legal" if style == "legal" else "simple"]
+
+    return "".join((intro, "\n\n", tone, _TAX_HEAD, message[:250], _TAX_TAIL))
 
 
 # -------------------------------------------
 # 6. PDF + DOCX GENERATION
 # -------------------------------------------
-def generate_docx_stream(text: str):
+def _build_docx_skeleton():
+    """
+    Split python-docx's default template into a pre-compressed zip holding
+    every part except word/document.xml, plus that part's text before and
+    after the body content. Styles alone are ~800KB of XML, so compressing
+    them once here instead of per reply is most of the saving.
+    """
+    template = BytesIO()
+    Document().save(template)
+    skeleton = BytesIO()
+    with zipfile.ZipFile(template) as src, \
+            zipfile.ZipFile(skeleton, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            if item.filename == "word/document.xml":
+                document_xml = src.read(item).decode("utf-8")
+            else:
+                dst.writestr(item.filename, src.read(item))
+    body = document_xml.index("<w:body>") + len("<w:body>")
+    sect = document_xml.index("<w:sectPr", body)
+    return skeleton.getvalue(), document_xml[:body], document_xml[sect:]
+
+_DOCX_SKELETON, _DOCX_HEAD, _DOCX_TAIL = _build_docx_skeleton()
+# characters XML 1.0 can't carry (python-docx rejects them as well)
+_XML_INVALID_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def _docx_paragraph(line):
+    if not line:
+        return "<w:p/>"
+    runs = '</w:t><w:tab/><w:t xml:space="preserve">'.join(xml_escape(line).split("\t"))
+    return f'<w:p><w:r><w:t xml:space="preserve">{runs}</w:t></w:r></w:p>'
+
+def generate_docx_stream(text: str, filename=None):
     """
     Create a DOCX file in memory and return (filename, BytesIO buffer)
+    One paragraph per line, written as raw WordprocessingML on top of the
+    cached template parts instead of one python-docx add_paragraph per line.
     """
-    doc = Document()
-    for line in text.split("\n"):
-        doc.add_paragraph(line)
-
-    buffer = BytesIO()
-    doc.save(buffer)
+    text = _XML_INVALID_RE.sub("", text.replace("\r", ""))
+    document_xml = _DOCX_HEAD + "".join(map(_docx_paragraph, text.split("\n"))) + _DOCX_TAIL
+
+    buffer = BytesIO(_DOCX_SKELETON)
+    buffer.seek(0, 2)
+    # append mode adds document.xml after the cached parts and rewrites the directory
+    with zipfile.ZipFile(buffer, "a", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        zf.writestr("word/document.xml", document_xml)
     buffer.seek(0)
 
-    filename = f"{uuid.uuid4().hex}.docx"
+    filename = filename or f"{uuid.uuid4().hex}.docx"
     return filename, buffer
+
+# -------------------------------------------
+# 7. SYSTEM PROMPTS PER ROUTED INTENT
+# -------------------------------------------
+DEFAULT_SYSTEM_PROMPT = "You are LegalSathi, a global AI legal assistant."
+
+SYSTEM_PROMPTS = {
+    "contract": "You are LegalSathi, a global contract drafting expert. Generate structured legal agreements as per detected jurisdiction.",
+    "tax_reply": "You are LegalSathi, a global tax notice reply expert. Generate clear, concise, structured replies for GST, VAT, IRS, HMRC, IT notices.",
+    "notice_reply": "You are LegalSathi, draft professional legal notices and replies.",
+    "clause_review": "You are LegalSathi, a clause rewriting expert. Improve, polish, and legally strengthen clauses.",
+    "document_summary": "You are LegalSathi, summarize documents clearly with risks highlighted.",
+    "lawyer_mode": "You are LegalSathi-ADV, behaving like a senior lawyer. Provide deep legal reasoning, citations, and structured guidance.",
+}
+
 # --- Routes ---
 
 @app.route("/api/gst/calc", methods=["POST"])
@@ -684,6 +1207,31 @@ def api_gst_calc():
     result = calculate_gst(amount, rate, inclusive=inclusive, interstate=interstate)
     return jsonify(result)
 
+@app.route("/api/gst/calc_batch", methods=["POST"])
+def api_gst_calc_batch():
+    """
+    POST JSON:
+      { "amounts": [1000, 250.5, ...], "rate": 18, "inclusive": false, "interstate": false }
+    Returns one list per column (base_amount, gst_amount, ...) plus invoice totals.
+    """
+    data = request.get_json(force=True)
+    try:
+        amounts = np.asarray(data.get("amounts") or [], dtype=np.float64)
+        rate = float(data.get("rate", 18))
+        inclusive = bool(data.get("inclusive", False))
+        interstate = bool(data.get("interstate", False))
+    except Exception:
+        return jsonify({"error": "Invalid input"}), 400
+    if amounts.ndim != 1:
+        return jsonify({"error": "Invalid input"}), 400
+
+    rows = calculate_gst_batch(amounts, rate, inclusive=inclusive, interstate=interstate)
+    totals = [round(x, 2) for x in rows.sum(axis=0).tolist()]
+    result = {col: rows[:, i].tolist() for i, col in enumerate(GST_BATCH_COLUMNS)}
+    result["totals"] = dict(zip(GST_BATCH_COLUMNS, totals))
+    result.update({"rate_percent": rate, "inclusive": inclusive, "interstate": interstate})
+    return jsonify(result)
+
 @app.route("/api/gst/tips")
 def api_gst_tips():
     """
@@ -717,19 +1265,62 @@ def api_gst_tips():
 def home():
     return "⚖️ LegalSathi backend active"
 
+@app.route("/healthz")
+def healthz():
+    """
+    Liveness/readiness probe. The Mongo ping goes through the shared pool,
+    so a platform health check also keeps warm connections checked out.
+    """
+    status = {"mongo": "disabled", "groq": "ok" if client is not None else "unavailable"}
+    if mongo is not None:
+        try:
+            mongo.admin.command("ping")
+            status["mongo"] = "ok"
+        except Exception as e:
+            print("healthz mongo error:", e)
+            status["mongo"] = "error"
+    ok = status["mongo"] != "error" and status["groq"] == "ok"
+    return jsonify(status), 200 if ok else 503
+
 
 @app.route("/download_docx/<filename>")
 def download_docx(filename):
-    if filename not in DOCX_TEMP:
+    job = DOCX_JOBS.get(filename)
+    if job is not None:
+        try:
+            job.result(timeout=30)
+        except FuturesTimeout:
+            return "DOCX is still being generated", 503, {"Retry-After": "1"}
+        except Exception as e:
+            print("docx render error:", e)
+    path = os.path.join(PDF_DIR, filename)
+    if not os.path.exists(path):
+        if render_pending(path):
+            return "DOCX is still being generated", 503, {"Retry-After": "1"}
         return "File not found", 404
 
-    buffer = DOCX_TEMP[filename]
     return send_file(
-        buffer,
+        path,
         download_name=filename,
         as_attachment=True,
         mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
     )
+@app.route("/api/doc_status/<doc_id>")
+def doc_status(doc_id):
+    """
+    Whether the PDF + DOCX for a streamed reply have finished rendering.
+    Read from disk (final file = ready, .part = pending) so every gunicorn
+    worker answers the same, not just the one that queued the renders.
+    """
+    pdf_path = os.path.join(PDF_DIR, f"{doc_id}.pdf")
+    docx_path = os.path.join(PDF_DIR, f"{doc_id}.docx")
+    return jsonify({
+        "ready": os.path.exists(pdf_path) and os.path.exists(docx_path),
+        "pending": render_pending(pdf_path) or render_pending(docx_path),
+        "pdf_url": f"/download/{doc_id}.pdf",
+        "docx_url": f"/download_docx/{doc_id}.docx",
+    })
+
 # ============================================================
 #  PART 3 — FULL UPGRADED /api/stream_chat (GLOBAL LEGALSATHI ENGINE)
 # ============================================================
@@ -758,63 +1349,40 @@ def stream_chat():
         # -----------------------------------------------------
         # 1. CREATE OR VALIDATE CONVERSATION
         # -----------------------------------------------------
-        conv_doc = None
-
         # New conversation?
         if not conv_id or not is_valid_objectid(conv_id):
             conv = create_conversation(user_id, title="New conversation")
             conv_id = conv["_id"]
-            conv_doc = conv
 
-        else:
-            # Validate existing conversation (if DB exists)
-            if db is not None:
-                try:
-                    conv_doc = db.get_collection("conversations").find_one({"_id": ObjectId(conv_id)})
-                    if not conv_doc or conv_doc.get("user_id") != user_id:
-                        return jsonify({"error": "Invalid conversation ID"}), 403
-                except:
+        # Validate existing conversation (if DB exists)
+        elif db is not None:
+            try:
+                if conversation_owner(conv_id) != user_id:
                     return jsonify({"error": "Invalid conversation ID"}), 403
-            else:
-                conv_doc = {"_id": conv_id, "user_id": user_id}
+            except:
+                return jsonify({"error": "Invalid conversation ID"}), 403
 
-        # Save user message
-        add_message(conv_id, "user", message)
+        # parse once, reuse for every Mongo call in this request
+        conv_oid = ObjectId(conv_id)
+
+        # the user message is saved with the reply at the end of the stream
+        user_ts = time.time()
 
         # -----------------------------------------------------
         # 2. DETECT INTENT, JURISDICTION, STYLE
         # -----------------------------------------------------
-        intent = detect_legal_intent(message)
-        jurisdiction = detect_jurisdiction(message)
-        style = detect_writing_style(message)
+        intent, jurisdiction, style = route_message(message)
 
         # -----------------------------------------------------
         # 3. SYSTEM PROMPT BASED ON ROUTED INTENT
         # -----------------------------------------------------
-        if intent == "contract":
-            system_prompt = "You are LegalSathi, a global contract drafting expert. Generate structured legal agreements as per detected jurisdiction."
-
-        elif intent == "tax_reply":
-            system_prompt = "You are LegalSathi, a global tax notice reply expert. Generate clear, concise, structured replies for GST, VAT, IRS, HMRC, IT notices."
-
-        elif intent == "notice_reply":
-            system_prompt = "You are LegalSathi, draft professional legal notices and replies."
-
-        elif intent == "clause_review":
-            system_prompt = "You are LegalSathi, a clause rewriting expert. Improve, polish, and legally strengthen clauses."
-
-        elif intent == "document_summary":
-            system_prompt = "You are LegalSathi, summarize documents clearly with risks highlighted."
-
-        elif intent == "lawyer_mode":
-            system_prompt = "You are LegalSathi-ADV, behaving like a senior lawyer. Provide deep legal reasoning, citations, and structured guidance."
-
-        else:
-            system_prompt = "You are LegalSathi, a global AI legal assistant."
+        system_prompt = SYSTEM_PROMPTS.get(intent, DEFAULT_SYSTEM_PROMPT)
 
         # Branding only ONCE (first assistant message)
-        message_history = build_context(conv_id, max_messages=12)
-        is_first_reply = len(message_history) <= 1
+        # prior turns only: the new message is appended locally below,
+        # so 11 + 1 keeps the original 12-message window
+        message_history = build_context(conv_oid, max_messages=11)
+        is_first_reply = not message_history
 
         branding = ""
         if is_first_reply:
@@ -853,72 +1421,115 @@ def stream_chat():
         # -----------------------------------------------------
         # 6. STREAMING RESPONSE GENERATOR
         # -----------------------------------------------------
+        cache_key = reply_cache_key(messages_for_ai)
+        cached_reply = get_cached_reply(cache_key)
+
         def generate_stream():
-            final_text = ""
+            parts = []  # every delta received; joined once when the stream ends
+            complete = False
+            upstream = None
+            pending, pending_len = [], 0  # deltas not yet sent to the client
 
-            # Stream from GROQ
+            # Stream from GROQ (or replay an identical earlier answer)
             try:
-                for chunk in client.chat.completions.create(
-                    model="llama-3.1-8b-instant",
-                    messages=messages_for_ai,
-                    stream=True
-                ):
-                    if (
-                        chunk
-                        and chunk.choices
-                        and hasattr(chunk.choices[0].delta, "content")
-                        and chunk.choices[0].delta.content
-                    ):
-                        delta = chunk.choices[0].delta.content
-                        final_text += delta
-                        yield json.dumps({"chunk": delta}) + "\n"
+                if cached_reply is not None:
+                    parts.append(cached_reply)
+                    yield sse_chunk(cached_reply)
+                else:
+                    upstream = client.chat.completions.create(
+                        model="llama-3.1-8b-instant",
+                        messages=messages_for_ai,
+                        stream=True
+                    )
+                    last_flush = time.monotonic()
+                    for chunk in upstream:
+                        # the SDK always yields ChatCompletionChunk objects:
+                        # one attribute path, no per-token hasattr probing
+                        choices = chunk.choices
+                        if not choices:
+                            continue
+                        delta = choices[0].delta.content
+                        if not delta:
+                            continue
+                        parts.append(delta)
+                        # coalesce 1-4 char tokens into fewer, larger frames
+                        pending.append(delta)
+                        pending_len += len(delta)
+                        now = time.monotonic()
+                        if pending_len >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_SECONDS:
+                            yield sse_chunk("".join(pending))
+                            pending, pending_len, last_flush = [], 0, now
+                    if pending:
+                        yield sse_chunk("".join(pending))
+                        pending = []
+                    complete = True
+
+            except GeneratorExit:
+                # client went away mid-stream: release the Groq connection so we
+                # stop paying for tokens nobody reads, and record the partial reply
+                if upstream is not None:
+                    try:
+                        upstream.close()
+                    except Exception as e:
+                        print("Closing Groq stream failed:", e)
+                _PERSIST_POOL.submit(_persist_turn, conv_oid, message, user_ts, "".join(parts), True)
+                raise
 
             except Exception as stream_err:
                 print("Streaming failed:", stream_err)
-                yield json.dumps({"chunk": "\n[Streaming failed]\n"}) + "\n"
+                if pending:
+                    yield sse_chunk("".join(pending))
+                fallback = ""
+                if not parts and client is not None:
+                    # nothing streamed yet: retry once as a blocking completion
+                    try:
+                        completion = client.chat.completions.create(
+                            model="llama-3.1-8b-instant",
+                            messages=messages_for_ai
+                        )
+                        fallback = completion.choices[0].message.content or ""
+                    except Exception as e:
+                        print("Blocking fallback failed:", e)
+                if fallback:
+                    parts = [fallback]
+                    for piece in simulate_stream(fallback):
+                        yield sse_chunk(piece)
+                else:
+                    yield sse_chunk("\n[Streaming failed]\n")
+
+            final_text = "".join(parts)
+            # only complete streams are reused
+            if complete:
+                cache_reply(cache_key, final_text)
 
             # -----------------------------------------------------
-            # 7. SAVE ASSISTANT RESPONSE
+            # 7. SAVE USER + ASSISTANT MESSAGES (in background)
             # -----------------------------------------------------
-            try:
-                add_message(conv_id, "assistant", final_text)
-                db.get_collection("conversations").update_one(
-                    {"_id": ObjectId(conv_id)},
-                    {
-                        "$set": {
-                            "updated_at": time.time(),
-                            "title": (final_text[:60] or "Conversation"),
-                            "last_message": final_text
-                        }
-                    }
-                )
-            except Exception as e:
-                print("Save assistant error:", e)
+            _PERSIST_POOL.submit(_persist_turn, conv_oid, message, user_ts, final_text)
 
             # -----------------------------------------------------
             # 8. GENERATE PDF + DOCX AFTER STREAM ENDS
             # -----------------------------------------------------
-            from pdf_utils import text_to_pdf
-            pdf_name = f"{uuid.uuid4().hex}.pdf"
-            pdf_path = text_to_pdf(final_text, pdf_name)
-
-            # DOCX (in-memory)
-            docx_name, docx_buffer = generate_docx_stream(final_text)
-
-            # Save DOCX buffer to temp memory store
-            DOCX_TEMP[docx_name] = docx_buffer
+            # rendered in the background so "done" isn't held up by
+            # reportlab/python-docx; the download routes wait on the jobs
+            doc_id = uuid.uuid4().hex
+            pdf_name = f"{doc_id}.pdf"
+            docx_name = f"{doc_id}.docx"
+            render_pdf_async(final_text, pdf_name)
+            render_docx_async(final_text, docx_name)
 
             # -----------------------------------------------------
             # 9. FINAL SIGNAL
             # -----------------------------------------------------
-            yield json.dumps({
+            yield sse_event({
                 "done": True,
                 "conv_id": conv_id,
                 "pdf_url": f"/download/{pdf_name}",
-                "docx_url": f"/download_docx/{docx_name}"
-            }) + "\n"
+                "docx_url": f"/download_docx/{docx_name}",
+                "doc_id": doc_id
+            })
 
-        return Response(stream_with_context(generate_stream()), mimetype="text/plain")
+        return Response(generate_stream(), mimetype="text/event-stream", headers=SSE_HEADERS)
 
     except Exception as e:
         print("stream_chat error:", e)
@@ -928,10 +1539,13 @@ def stream_chat():
 @app.route("/api/conversations/<user_id>")
 def get_conversations(user_id):
     try:
-        convs = list(db.get_collection("conversations").find({"user_id": user_id}).sort("updated_at", -1))
+        convs = list(conversations_col
+                     .find({"user_id": user_id},
+                           projection={"title": 1, "last_message": 1, "updated_at": 1})
+                     .sort("updated_at", -1))
         for c in convs:
             c["_id"] = str(c["_id"])
-        return jsonify(convs)
+        return orjson_response(convs)
     except Exception as e:
         print("get_conversations error:", e)
         return jsonify([])
@@ -939,13 +1553,18 @@ def get_conversations(user_id):
 @app.route("/api/conversation/<conv_id>")
 def get_conversation(conv_id):
     try:
-        msgs = list(db.get_collection("messages").find({"conv_id": ObjectId(conv_id)}).sort("timestamp", 1))
-        out = []
-        for m in msgs:
-            m["_id"] = str(m["_id"])
-            m["conv_id"] = str(m["conv_id"])
-            out.append(m)
-        return jsonify(out)
+        cursor = (messages_col
+                  .find({"conv_id": ObjectId(conv_id)},
+                        projection={"role": 1, "content": 1, "timestamp": 1})
+                  .sort("timestamp", 1)
+                  .batch_size(500))
+        out = [{
+            "_id": str(m["_id"]),
+            "role": m["role"],
+            "content": m["content"],
+            "timestamp": m.get("timestamp")
+        } for m in cursor]
+        return orjson_response(out)
     except Exception as e:
         print("get_conversation error:", e)
         return jsonify([])
@@ -953,7 +1572,7 @@ def get_conversation(conv_id):
 @app.route("/api/files/<user_id>")
 def list_files(user_id):
     try:
-        docs = list(db.get_collection("file_records").find({"user_id": user_id}).sort("timestamp", -1))
+        docs = list(file_records_col.find({"user_id": user_id}).sort("timestamp", -1))
         for d in docs:
             d["_id"] = str(d["_id"])
         return jsonify(docs)
@@ -978,50 +1597,79 @@ def upload_file():
         if not user_id or not file:
             return jsonify({"error": "Missing fields"}), 400
 
+        # reject unsupported types before streaming anything to disk
+        ext = os.path.splitext(file.filename or "")[1].lower()
+        if ext not in UPLOAD_EXTENSIONS:
+            return jsonify({"error": "Unsupported file type"}), 400
+
         # ---- Save actual uploaded file ----
-        filename = f"{uuid.uuid4().hex}_{file.filename}"
+        # one id per upload names both the stored file and its summary PDF
+        req_id = uuid.uuid4().hex
+        filename = f"{req_id}_{file.filename}"
         filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
+
+        # hash while writing so repeat uploads can skip extraction + AI
+        sha = hashlib.sha256()
+        with open(filepath, "wb") as out:
+            for block in iter(lambda: file.stream.read(64 * 1024), b""):
+                sha.update(block)
+                out.write(block)
+        content_sha256 = sha.hexdigest()
+        cached = get_cached_upload(content_sha256)
 
         # ---- Extract text from uploaded doc ----
-        lower = filename.lower()
-        if lower.endswith(".pdf"):
-            content = extract_pdf_text(filepath)
-        elif lower.endswith(".docx"):
-            content = extract_docx_text(filepath)
-        elif lower.endswith(".txt"):
-            content = open(filepath, "r", encoding="utf8", errors="ignore").read()
+        if cached:
+            content = cached["extracted_text"]
+        elif ext == ".pdf":
+            content = extract_pdf_text(filepath, max_chars=DOC_CONTEXT_CHARS)
+        elif ext == ".docx":
+            content = extract_docx_text(filepath, max_chars=DOC_CONTEXT_CHARS)
         else:
-            return jsonify({"error": "Unsupported file type"}), 400
+            # .txt: decode only the characters that can reach the AI
+            with open(filepath, encoding="utf-8", errors="replace") as f:
+                content = f.read(DOC_CONTEXT_CHARS)
 
         # ---- Create conversation if needed ----
+        # (the id is assigned here; the insert rides along with the first
+        # message writes below instead of blocking before the AI call)
+        new_conv = None
         if not conv_id or not is_valid_objectid(conv_id):
-            conv = {
+            new_conv = {
+                "_id": ObjectId(),
                 "user_id": user_id,
                 "title": file.filename,
                 "created_at": time.time(),
                 "updated_at": time.time(),
-                "last_message": ""
+                "last_message": "",
+                "recent_messages": []
             }
-            conv_res = db.get_collection("conversations").insert_one(conv)
-            conv_id = str(conv_res.inserted_id)
+            conv_id = str(new_conv["_id"])
+
+        conv_oid = ObjectId(conv_id)
+        if new_conv is None:
+            # seed recent_messages first, or this upload's $push would
+            # replace an older conversation's history
+            ensure_recent(conv_oid)
 
         # ---- (KEY FEATURE) Insert the file content as a hidden system message ----
         # This is how ChatGPT allows follow-up questions about the file.
-        db.get_collection("messages").insert_one({
-            "conv_id": ObjectId(conv_id),
-            "role": "system",
-            "content": f"__FILE_CONTENT__\n{content}",
-            "timestamp": time.time()
-        })
-
-        # ---- Save user message indicating upload ----
-        db.get_collection("messages").insert_one({
-            "conv_id": ObjectId(conv_id),
-            "role": "user",
-            "content": f"📄 Uploaded file: {file.filename}",
-            "timestamp": time.time()
-        })
+        # Together with the "uploaded" user message it is written in the
+        # background while the AI summary is generated.
+        pre_ai_write = _PERSIST_POOL.submit(_save_upload_start, new_conv, [
+            {
+                "conv_id": conv_oid,
+                "role": "system",
+                "content": f"__FILE_CONTENT__\n{content}",
+                "timestamp": time.time()
+            },
+            # ---- Save user message indicating upload ----
+            {
+                "conv_id": conv_oid,
+                "role": "user",
+                "content": f"📄 Uploaded file: {file.filename}",
+                "timestamp": time.time()
+            },
+        ])
 
         # ---- Generate AI summary (first response) ----
         summary_prompt = (
@@ -1029,33 +1677,43 @@ def upload_file():
             "Provide a clear high-level summary. "
             "DO NOT lose the document content — future prompts will reference it."
         )
-        reply = ask_ai(summary_prompt, content[:8000])
+        reply = cached["reply"] if cached else ask_ai(summary_prompt, content[:DOC_CONTEXT_CHARS])
+        pre_ai_write.result()
 
         # ---- Save assistant reply ----
-        db.get_collection("messages").insert_one({
-            "conv_id": ObjectId(conv_id),
-            "role": "assistant",
-            "content": reply,
-            "timestamp": time.time()
-        })
+        add_message(conv_oid, "assistant", reply)
 
         # ---- Update conversation metadata ----
-        db.get_collection("conversations").update_one(
-            {"_id": ObjectId(conv_id)},
-            {"$set": {"updated_at": time.time(), "last_message": reply}}
+        conversations_col.update_one(
+            {"_id": conv_oid},
+            {
+                "$set": {"updated_at": time.time(), "last_message": message_snippet(reply)},
+                "$push": push_recent(
+                    ("system", f"__FILE_CONTENT__\n{content}"),
+                    ("user", f"📄 Uploaded file: {file.filename}"),
+                    ("assistant", reply),
+                ),
+            }
         )
 
-        # ---- Generate summary PDF ----
-        pdfname = f"{uuid.uuid4().hex[:8]}.pdf"
-        text_to_pdf(reply, pdfname)
+        # ---- Generate summary PDF (reuse the cached one if still on disk) ----
+        if cached and (render_pending(os.path.join(PDF_DIR, cached["pdf"]))
+                       or os.path.exists(os.path.join(PDF_DIR, cached["pdf"]))):
+            pdfname = cached["pdf"]
+        else:
+            pdfname = f"{req_id[:8]}.pdf"
+            render_pdf_async(reply, pdfname)
+            if not reply.startswith("⚠️"):
+                _PERSIST_POOL.submit(cache_upload, content_sha256, content, reply, pdfname)
 
-        # ---- Also save file record ----
-        db.get_collection("file_records").insert_one({
+        # ---- Also save file record (off the response path) ----
+        _PERSIST_POOL.submit(_save_file_record, {
             "user_id": user_id,
             "original_name": file.filename,
             "stored_path": filepath,
+            "content_sha256": content_sha256,
             "pdf": pdfname,
-            "conv_id": ObjectId(conv_id),
+            "conv_id": conv_oid,
             "timestamp": time.time()
         })
 
@@ -1072,9 +1730,22 @@ def upload_file():
 
 @app.route("/download/<filename>")
 def download(filename):
-    path = os.path.join("generated_pdfs", filename)
+    path = os.path.join(PDF_DIR, filename)
+    # check the job first: reportlab creates the file before it finishes writing
+    job = PDF_JOBS.get(filename)
+    if job is not None:
+        try:
+            job.result(timeout=30)
+        except FuturesTimeout:
+            # still rendering; let the client retry instead of a false 404
+            return "PDF is still being generated", 503, {"Retry-After": "1"}
+        except Exception as e:
+            print("pdf render error:", e)
     if os.path.exists(path):
         return send_file(path, as_attachment=True)
+    # rendering (or queued) on another worker: PDF_JOBS can't see it, the .part can
+    if render_pending(path):
+        return "PDF is still being generated", 503, {"Retry-After": "1"}
     return "File not found", 404
 
 
@@ -1099,8 +1770,13 @@ def library(user_id):
 @app.route("/api/conversation/<conv_id>", methods=["DELETE"])
 def delete_conversation(conv_id):
     try:
-        db.get_collection("conversations").delete_one({"_id": ObjectId(conv_id)})
-        db.get_collection("messages").delete_many({"conv_id": ObjectId(conv_id)})
+        oid = ObjectId(conv_id)
+        conversations_col.delete_one({"_id": oid})
+        # match both ObjectId and legacy string conv_ids in one query;
+        # file_records are kept, uploads stay in /api/files and the Library
+        messages_col.delete_many({"conv_id": {"$in": [oid, conv_id]}})
+        with _owner_cache_lock:
+            _owner_cache.pop(conv_id, None)
         return jsonify({"status": "ok"})
     except Exception as e:
         print("delete_conversation error:", e)
@@ -1118,4 +1794,5 @@ def internal_error(error):
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
     print(f"🚀 LegalSathi backend is running on 0.0.0.0:{port}/")
-    app.run(host="0.0.0.0", port=port)
+    # dev server only; use `gunicorn -c gunicorn.conf.py app:app` in production
+    app.run(host="0.0.0.0", port=port, threaded=True)
@@ -0,0 +1,15 @@
+# backend/gunicorn.conf.py
+# Production entrypoint: gunicorn -c gunicorn.conf.py app:app
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+
+# /api/stream_chat holds its connection for the whole reply; threaded workers
+# keep many concurrent streams cheap instead of one process per stream
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+
+# long replies can stream for a while
+timeout = 120
+keepalive = 5
@@ -28,6 +28,40 @@ except Exception:
 # -----------------------
 # 1) Simple detectors (improve over time)
 # -----------------------
+# Keyword tables, checked in priority order: the first row with a keyword
+# in the lowercased text wins. Built once at import instead of rebuilding
+# the keyword lists on every call.
+_INTENT_RULES = (
+    (("gst", "tax", "income tax", "vat", "hmrc", "irs", "scn", "notice", "section 143", "143(1)", "143(2)", "notice under"), "tax_reply"),
+    (("draft", "contract", "agreement", "rent agreement", "nda", "service agreement", "moa", "mou"), "contract"),
+    (("clause", "redline", "review clause", "strengthen clause", "rewrite clause", "risk", "loophole"), "clause_review"),
+    (("summarize", "summarise", "explain", "what does", "summary", "highlight", "find", "extract"), "document_summary"),
+    (("advise", "strategy", "case law", "precedent", "legal research", "citation", "argument"), "lawyer_mode"),
+    (("legal notice", "notice reply", "demand notice", "s138", "cheque bounce", "notice under"), "notice_reply"),
+)
+
+_JURISDICTION_RULES = (
+    (("india", "gst", "income tax", "section 138", "rera"), "India"),
+    (("uk", "hmrc"), "UK"),
+    (("usa", "california", "irs", "us "), "USA"),
+    (("uae",), "UAE"),
+)
+
+_STYLE_RULES = (
+    (("formal", "professional"), "formal"),
+    (("brief", "concise", "short"), "concise"),
+    (("friendly", "simple"), "friendly"),
+)
+
+
+def _first_match(t: str, rules, default: str) -> str:
+    for keywords, result in rules:
+        for k in keywords:
+            if k in t:
+                return result
+    return default
+
+
 def detect_legal_intent(text: str) -> str:
     """
     Intent categories used by stream_chat:
@@ -39,33 +73,7 @@ def detect_legal_intent(text: str) -> str:
     - lawyer_mode
     - general
     """
-    t = (text or "").lower()
-
-    # tax keywords
-    if any(k in t for k in ["gst", "tax", "income tax", "vat", "hmrc", "irs", "scn", "notice", "section 143", "143(1)", "143(2)", "notice under"]):
-        return "tax_reply"
-
-    # contract drafting
-    if any(k in t for k in ["draft", "contract", "agreement", "rent agreement", "nda", "service agreement", "moa", "mou"]):
-        return "contract"
-
-    # clause review / redline
-    if any(k in t for k in ["clause", "redline", "review clause", "strengthen clause", "rewrite clause", "risk", "loophole"]):
-        return "clause_review"
-
-    # document summary/explain
-    if any(k in t for k in ["summarize", "summarise", "explain", "what does", "summary", "highlight", "find", "extract"]):
-        return "document_summary"
-
-    # lawyer mode
-    if any(k in t for k in ["advise", "strategy", "case law", "precedent", "legal research", "citation", "argument"]):
-        return "lawyer_mode"
-
-    # notice reply
-    if any(k in t for k in ["legal notice", "notice reply", "demand notice", "s138", "cheque bounce", "notice under"]):
-        return "notice_reply"
-
-    return "general"
+    return _first_match((text or "").lower(), _INTENT_RULES, "general")
 
 
 def detect_jurisdiction(text: str) -> str:
@@ -74,31 +82,14 @@ def detect_jurisdiction(text: str) -> str:
     Returns canonical short code or 'global'.
     Improve this later by integrating IP / user preference.
     """
-    t = (text or "").lower()
-    # simple rules
-    if "india" in t or "gst" in t or "income tax" in t or "section 138" in t or "rera" in t:
-        return "India"
-    if "uk" in t or "hmrc" in t or "uk" in t:
-        return "UK"
-    if "usa" in t or "california" in t or "irs" in t or "us " in t:
-        return "USA"
-    if "uae" in t or "vat" in t and "uae" in t:
-        return "UAE"
-    return "Global"
+    return _first_match((text or "").lower(), _JURISDICTION_RULES, "Global")
 
 
 def detect_writing_style(text: str) -> str:
     """
     Basic style detection: 'formal', 'concise', 'friendly', 'legalese'
     """
-    t = (text or "").lower()
-    if any(k in t for k in ["draft in formal", "formal", "professional"]):
-        return "formal"
-    if any(k in t for k in ["brief", "concise", "short"]):
-        return "concise"
-    if any(k in t for k in ["friendly", "simple"]):
-        return "friendly"
-    return "legalese"
+    return _first_match((text or "").lower(), _STYLE_RULES, "legalese")
 
 # -----------------------
 # 2) Prompt templates
@@ -236,10 +227,17 @@ def precedent_search(user_id: str, query: str, limit: int = 5) -> List[Dict[str,
         {"content": {"$regex": query, "$options": "i"}}
     ]}
 
+    # only the user's own conversations; lets Mongo use the conv_id index
+    # instead of regex-scanning every stored message
+    conv_ids = db.get_collection("conversations").distinct("_id", {"user_id": user_id})
+
     # search messages
     hits = []
     # messages that look like uploaded file system messages
-    for m in db.get_collection("messages").find({"role": {"$in": ["system", "assistant", "user"]}, "content": {"$regex": query, "$options": "i"}}).limit(limit):
+    for m in db.get_collection("messages").find(
+            {"conv_id": {"$in": conv_ids}, "role": {"$in": ["system", "assistant", "user"]},
+             "content": {"$regex": query, "$options": "i"}},
+            projection={"content": 1, "conv_id": 1, "timestamp": 1}).limit(limit):
         hits.append({
             "source": "message",
             "content": m["content"][:1000],
@@ -248,7 +246,9 @@ def precedent_search(user_id: str, query: str, limit: int = 5) -> List[Dict[str,
         })
 
     # search files
-    for f in db.get_collection("file_records").find({"original_name": {"$regex": query, "$options": "i"}}).limit(limit):
+    for f in db.get_collection("file_records").find(
+            {"user_id": user_id, "original_name": {"$regex": query, "$options": "i"}},
+            projection={"original_name": 1, "conv_id": 1, "timestamp": 1}).limit(limit):
         hits.append({
             "source": "file",
             "original_name": f.get("original_name"),
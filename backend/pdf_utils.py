@@ -1,14 +1,39 @@
 # backend/pdf_utils.py
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import stringWidth
 import os
-import textwrap
+
+PDF_DIR = "generated_pdfs"
+os.makedirs(PDF_DIR, exist_ok=True)
+
+def wrap_line(paragraph, font_name, font_size, max_width):
+    """
+    Wrap on real font widths. simpleSplit only breaks at spaces, so a token
+    wider than the line (URL, hash, reference number) is hard-broken here.
+    """
+    lines = []
+    for line in simpleSplit(paragraph, font_name, font_size, max_width):
+        if stringWidth(line, font_name, font_size) <= max_width:
+            lines.append(line)
+            continue
+        start, used = 0, 0.0
+        for i, ch in enumerate(line):
+            w = stringWidth(ch, font_name, font_size)
+            if used + w > max_width and i > start:
+                lines.append(line[start:i])
+                start, used = i, 0.0
+            used += w
+        lines.append(line[start:])
+    return lines
 
 def text_to_pdf(text, filename="LegalSathi_Document.pdf"):
-    os.makedirs("generated_pdfs", exist_ok=True)
-    pdf_path = os.path.join("generated_pdfs", filename)
+    pdf_path = os.path.join(PDF_DIR, filename)
 
-    c = canvas.Canvas(pdf_path, pagesize=A4)
+    # render to <name>.part and rename at the end, so a download (from any
+    # worker) never sees a half-written PDF
+    c = canvas.Canvas(pdf_path + ".part", pagesize=A4)
     width, height = A4
     margin = 50
     y = height - margin
@@ -16,28 +41,38 @@ def text_to_pdf(text, filename="LegalSathi_Document.pdf"):
     max_width = width - 2 * margin
     font_name = "Helvetica"
     font_size = 11
-    c.setFont(font_name, font_size)
 
-    # Use simple textwrap to respect canvas width
-    # estimate the number of characters per line (conservative)
-    approx_char_per_line = int(max_width / (font_size * 0.5))
+    def new_text():
+        # one text object per page: lines become Tj ops in a single BT block
+        # instead of a separate drawString call (and text block) per line
+        t = c.beginText(margin, height - margin)
+        t.setFont(font_name, font_size)
+        t.setLeading(line_height)
+        return t
+
+    text_obj = new_text()
     for paragraph in text.split("\n"):
         if not paragraph.strip():
+            text_obj.textLine("")
             y -= line_height
             if y < margin:
+                c.drawText(text_obj)
                 c.showPage()
-                c.setFont(font_name, font_size)
+                text_obj = new_text()
                 y = height - margin
             continue
 
-        wrapped = textwrap.wrap(paragraph, width=approx_char_per_line)
-        for line in wrapped:
+        # wrap on real Helvetica widths, not an estimated chars-per-line
+        for line in wrap_line(paragraph, font_name, font_size, max_width):
             if y < margin:
+                c.drawText(text_obj)
                 c.showPage()
-                c.setFont(font_name, font_size)
+                text_obj = new_text()
                 y = height - margin
-            c.drawString(margin, y, line)
+            text_obj.textLine(line)
             y -= line_height
 
+    c.drawText(text_obj)
     c.save()
+    os.replace(pdf_path + ".part", pdf_path)
     return pdf_path
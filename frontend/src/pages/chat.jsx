@@ -247,6 +247,7 @@ const [showExcerpts, setShowExcerpts] = useState(false);
       const decoder = new TextDecoder();
       let done = false;
       let accumulated = "";
+      let pending = "";
 
       // ensure UI shows we are generating
       setLoading(true);
@@ -255,10 +256,13 @@ const [showExcerpts, setShowExcerpts] = useState(false);
         const { value, done: doneReading } = await reader.read();
         done = doneReading;
         if (value) {
-          const chunk = decoder.decode(value, { stream: true });
-          // server sends newline delimited JSON per your backend; handle gracefully
-          const lines = chunk.split("\n").filter(Boolean);
-          for (const line of lines) {
+          pending += decoder.decode(value, { stream: true });
+          // server sends SSE frames ("data: {json}\n\n"); keep a partial frame for the next read
+          const frames = pending.split("\n\n");
+          pending = frames.pop();
+          for (const frame of frames) {
+            const line = frame.startsWith("data: ") ? frame.slice(6) : frame;
+            if (!line) continue;
             try {
               const obj = JSON.parse(line);
               if (obj.chunk) {
@@ -395,7 +399,7 @@ else if (obj.done) {
             } 
             catch (e) {
               // Not JSON fallback: treat chunk as plain text continuation for assistant
-accumulated += chunk;
+accumulated += line;
 
 setChats((prev) =>
   prev.map((c) => {